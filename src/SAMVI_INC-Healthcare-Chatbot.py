@@ -26,11 +26,10 @@ from minio import Minio
 from io import BytesIO
 import tempfile
 import PyPDF2
-from evidently.report import Report
-from evidently.metrics import ColumnSummaryMetric, DatasetSummaryMetric
-from evidently.ui.workspace import Workspace
-import pandas as pd
 import datetime
+import json
+import time
+import uuid
 
 # Load environment variables
 load_dotenv()
@@ -299,96 +298,85 @@ def config_rag_chain(llm, retriever, language="en"):
             return contextualize_q_chain.invoke(input_dict)
         return input_dict["input"]
     
-    # Create the RAG chain using LCEL
+    # MMR retrieval that keeps the FAISS L2 distances of the chunks it returns,
+    # so monitoring sees the scores of the context actually used
+    def retrieve(input_dict):
+        vectorstore = retriever.vectorstore
+        query_embedding = vectorstore.embeddings.embed_query(get_contextualized_question(input_dict))
+        results = vectorstore.max_marginal_relevance_search_with_score_by_vector(
+            query_embedding, **retriever.search_kwargs
+        )
+        return {
+            "docs": [doc for doc, _ in results],
+            "distances": [float(distance) for _, distance in results],
+        }
+    
+    # Create the RAG chain using LCEL; returns the answer and the retrieval
     rag_chain = (
-        RunnablePassthrough.assign(
-            context=lambda x: format_docs(
-                retriever.invoke(get_contextualized_question(x))
+        RunnablePassthrough.assign(retrieval=retrieve)
+        | RunnablePassthrough.assign(
+            answer=RunnablePassthrough.assign(
+                context=lambda x: format_docs(x["retrieval"]["docs"])
             )
+            | qa_prompt
+            | llm
+            | StrOutputParser()
         )
-        | qa_prompt
-        | llm
-        | StrOutputParser()
     )
     
     return rag_chain
 
 
-def log_to_evidently(user_input, response, feedback=None):
-    """Background thread function for Evidently logging"""
-    try:
-        # Prepare data
-        current_data = pd.DataFrame([
-            {
-                "user_input": user_input,
-                "response": response,
-                "timestamp": datetime.datetime.now().isoformat(),
-                "input_length": len(user_input),
-                "response_length": len(response),
-                "feedback": feedback if feedback else "no_feedback"
-            }
-        ])
-        
-        # Log to Evidently Workspace
-        try:
-            workspace_path = "evidently_workspace"
-            os.makedirs(workspace_path, exist_ok=True)
-            
-            ws = Workspace.create(workspace_path)
-            
-            # Create or get project
-            project_name = "Chatbot Monitoring"
-            project = None
-            
-            # Search for existing project
-            search_result = ws.search_project(project_name)
-            if search_result:
-                project = search_result[0]
-            else:
-                project = ws.create_project(project_name)
-                project.description = "Monitoring chatbot interactions"
-            
-            project.save()
-
-            # Create report with metrics that work without reference data
-            report = Report(metrics=[
-                DatasetSummaryMetric(),
-                ColumnSummaryMetric(column_name="user_input"),
-                ColumnSummaryMetric(column_name="response"),
-                ColumnSummaryMetric(column_name="input_length"),
-                ColumnSummaryMetric(column_name="response_length"),
-                ColumnSummaryMetric(column_name="feedback"),
-            ])
-            report.run(reference_data=None, current_data=current_data)
-            
-            # Add report to workspace
-            ws.add_report(project.id, report)
-            
-            print(f"✓ Report added to Evidently project '{project_name}'")
-            
-        except Exception as report_error:
-            print(f"Evidently logging failed: {report_error}")
+INTERACTIONS_LOG = os.getenv("INTERACTIONS_LOG", "monitoring/interactions.jsonl")
+_interactions_lock = threading.Lock()
+
 
+def log_interaction(event):
+    """Append an interaction or feedback event to the interactions log.
+
+    Drift and quality reports are built from this log by src/monitoring_job.py,
+    so the request path only pays for a single line append.
+    """
+    try:
+        with _interactions_lock:
+            # Stamp inside the lock so the log stays in time order across sessions
+            event = {"timestamp": datetime.datetime.now().isoformat(), **event}
+            line = json.dumps(event, ensure_ascii=False) + "\n"
+            os.makedirs(os.path.dirname(INTERACTIONS_LOG) or ".", exist_ok=True)
+            with open(INTERACTIONS_LOG, "a", encoding="utf-8") as f:
+                f.write(line)
     except Exception as e:
         print(f"Logging failed: {e}")
 
+
 def chat_llm(rag_chain, user_input):
     """Process user input and update chat history"""
     
     # Get response
-    response = rag_chain.invoke({
+    start = time.perf_counter()
+    result = rag_chain.invoke({
         "input": user_input,
         "chat_history": st.session_state.chat_history
     })
+    latency_ms = (time.perf_counter() - start) * 1000
 
-
+    response = result["answer"]
+    interaction_id = str(uuid.uuid4())
     
     # Update chat history
     st.session_state.chat_history.append(HumanMessage(content=user_input))
-    st.session_state.chat_history.append(AIMessage(content=response))
-    
-# Log to Evidently (Simple logging for now)
-    log_to_evidently(user_input, response)
+    st.session_state.chat_history.append(AIMessage(content=response, id=interaction_id))
+    
+    # Record the interaction for the monitoring job
+    log_interaction({
+        "event": "interaction",
+        "interaction_id": interaction_id,
+        "language": st.session_state.get("language"),
+        "user_input": user_input,
+        "response": response,
+        "latency_ms": latency_ms,
+        "retrieval_distances": result["retrieval"]["distances"],
+    })
     
     return response
 
@@ -535,19 +523,25 @@ def main():
                 with col1:
                     if st.button("👍", key=f"like_{idx}", disabled=has_feedback):
                         st.session_state.feedback_data[idx] = "like"
-                        # Re-log to Evidently with feedback
-                        if idx > 0:  # Make sure there's a user message before this
-                            user_msg = st.session_state.chat_history[idx-1].content
-                            log_to_evidently(user_msg, message.content, feedback="like")
+                        # Record feedback against the original interaction
+                        if message.id:
+                            log_interaction({
+                                "event": "feedback",
+                                "interaction_id": message.id,
+                                "feedback": "like",
+                            })
                         st.rerun()
                 
                 with col2:
                     if st.button("👎", key=f"dislike_{idx}", disabled=has_feedback):
                         st.session_state.feedback_data[idx] = "dislike"
-                        # Re-log to Evidently with feedback
-                        if idx > 0:  # Make sure there's a user message before this
-                            user_msg = st.session_state.chat_history[idx-1].content
-                            log_to_evidently(user_msg, message.content, feedback="dislike")
+                        # Record feedback against the original interaction
+                        if message.id:
+                            log_interaction({
+                                "event": "feedback",
+                                "interaction_id": message.id,
+                                "feedback": "dislike",
+                            })
                         st.rerun()
                 
                 with col3:
@@ -0,0 +1,553 @@
+"""
+Chatbot Monitoring Job - Incremental drift and quality analytics
+
+Reads the interactions log written by the chatbot since the last watermark,
+computes windowed quality aggregates and runs an Evidently drift report of the
+new batch against a rolling reference window, in a single pass.
+
+Run once:               python src/monitoring_job.py
+Run on timer:           python src/monitoring_job.py --interval 3600
+Replay quarantined:     python src/monitoring_job.py --replay-quarantine
+"""
+
+import argparse
+import glob
+import json
+import os
+import time
+
+import pandas as pd
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+INTERACTIONS_LOG = os.getenv("INTERACTIONS_LOG", "monitoring/interactions.jsonl")
+STATE_DIR = os.getenv("MONITORING_STATE_DIR", "monitoring")
+WORKSPACE_PATH = os.getenv("EVIDENTLY_WORKSPACE", "evidently_workspace")
+PROJECT_NAME = "Chatbot Monitoring"
+EMBEDDING_MODEL = "BAAI/bge-large-en-v1.5"
+
+WATERMARK_FILE = os.path.join(STATE_DIR, "watermark.json")
+REFERENCE_FILE = os.path.join(STATE_DIR, "reference.pkl")
+AGGREGATES_FILE = os.path.join(STATE_DIR, "aggregates.csv")
+QUARANTINE_DIR = os.path.join(STATE_DIR, "quarantine")
+
+NUMERICAL_FEATURES = [
+    "input_length",
+    "response_length",
+    "latency_ms",
+    "retrieval_top_distance",
+    "retrieval_mean_distance",
+]
+CATEGORICAL_FEATURES = ["language"]
+EMBEDDING_PREFIX = "query_emb_"
+
+AGGREGATE_COLUMNS = [
+    "window_start",
+    "interactions",
+    "latency_p50_ms",
+    "latency_p95_ms",
+    "latency_p99_ms",
+    "retrieval_top_distance_mean",
+    "retrieval_mean_distance_mean",
+    "likes",
+    "dislikes",
+    "feedback_ratio",
+]
+
+
+# ============================================================================
+# STATE
+# ============================================================================
+
+def load_state():
+    """Watermark state of the job.
+
+    - offset: byte offset into the interactions log that is fully processed
+    - last_window: end of the last completed window; older events are late
+    - failures: failed analysis attempts of the pending batch
+    - pending: batch being processed, with the steps already done, so a run
+      that dies half-way is resumed instead of repeated
+    """
+    state = {"offset": 0, "last_window": None, "failures": 0, "pending": None}
+    try:
+        with open(WATERMARK_FILE, encoding="utf-8") as f:
+            state.update(json.load(f))
+    except (FileNotFoundError, ValueError):
+        pass
+    return state
+
+
+def save_state(state):
+    """Persist the watermark state"""
+    save_json_atomic(WATERMARK_FILE, state)
+
+
+def save_json_atomic(path, data):
+    """Write JSON so that a crash never leaves a half-written state file"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_reference():
+    """Rolling reference window from previous runs (empty on first run)"""
+    if os.path.exists(REFERENCE_FILE):
+        return pd.read_pickle(REFERENCE_FILE)
+    return pd.DataFrame()
+
+
+def save_reference(reference):
+    """Replace the reference window atomically"""
+    tmp_path = f"{REFERENCE_FILE}.tmp"
+    reference.to_pickle(tmp_path)
+    os.replace(tmp_path, REFERENCE_FILE)
+
+
+# ============================================================================
+# INCREMENTAL READ
+# ============================================================================
+
+def read_new_events(path, offset, until=None, since=None, end=None):
+    """Read complete JSON lines appended after `offset`.
+
+    Returns the parsed events and the new offset. A trailing line that is still
+    being written is left for the next run; a log that shrank (rotated or
+    truncated) is read again from the start. When `until` is given, reading
+    stops at the first event stamped at or after it, so events of a window that
+    is still open stay behind the watermark. Events stamped before `since`
+    belong to a window that was already reported and are dropped. `end` stops
+    reading at a byte offset, to re-read exactly a pending batch.
+
+    Lines that are not valid JSON or carry no parseable timestamp are skipped
+    with a warning, so one bad line cannot block the watermark.
+    """
+    if not os.path.exists(path):
+        return [], 0
+
+    if os.path.getsize(path) < offset:
+        offset = 0
+
+    events = []
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for raw in f:
+            if end is not None and offset >= end:
+                break
+            if not raw.endswith(b"\n"):
+                break
+            try:
+                event = json.loads(raw)
+                timestamp = pd.Timestamp(event["timestamp"])
+                if pd.isna(timestamp):
+                    raise ValueError("empty timestamp")
+                if timestamp.tzinfo is not None:
+                    timestamp = timestamp.tz_convert(None)
+            except (KeyError, TypeError, ValueError) as e:
+                print(f"⚠ Skipping malformed log line at byte {offset}: {e}")
+                offset += len(raw)
+                continue
+            if until is not None and timestamp >= until:
+                break
+            offset += len(raw)
+            if since is not None and timestamp < since:
+                print(f"⚠ Dropping late event stamped {timestamp}, its window is already reported")
+                continue
+            event["timestamp"] = timestamp.isoformat()
+            events.append(event)
+    return events, offset
+
+
+def build_frames(events):
+    """Split raw events into an interactions frame and a feedback frame"""
+    df = pd.DataFrame(events)
+    if df.empty:
+        return pd.DataFrame(), pd.DataFrame()
+
+    df["timestamp"] = pd.to_datetime(df["timestamp"])
+    event_type = df.get("event", pd.Series("interaction", index=df.index))
+
+    interactions = df[event_type == "interaction"].copy()
+    feedback = df[event_type == "feedback"]
+    if feedback.empty:
+        feedback = pd.DataFrame()
+    else:
+        feedback = feedback[["timestamp", "interaction_id", "feedback"]].copy()
+
+    if not interactions.empty:
+        interactions["input_length"] = interactions["user_input"].str.len()
+        interactions["response_length"] = interactions["response"].str.len()
+        # FAISS L2 distances: lower means a closer match
+        distances = interactions["retrieval_distances"].apply(lambda d: d if isinstance(d, list) else [])
+        interactions["retrieval_top_distance"] = distances.apply(lambda d: min(d) if d else float("nan"))
+        interactions["retrieval_mean_distance"] = distances.apply(lambda d: sum(d) / len(d) if d else float("nan"))
+        interactions["language"] = interactions["language"].fillna("unknown")
+        interactions = interactions.drop(columns=["event", "feedback", "retrieval_distances"], errors="ignore")
+        interactions = interactions.reset_index(drop=True)
+
+    return interactions, feedback
+
+
+def load_embeddings():
+    """Load the query embedding model (downloads it on first use)"""
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+
+
+def add_query_embeddings(interactions, embeddings):
+    """Embed user queries so topic drift can be measured.
+
+    Only the new batch is embedded; the reference window keeps its embeddings
+    from earlier runs.
+    """
+    vectors = embeddings.embed_documents(interactions["user_input"].tolist())
+    columns = [f"{EMBEDDING_PREFIX}{i}" for i in range(len(vectors[0]))]
+    return pd.concat(
+        [interactions, pd.DataFrame(vectors, columns=columns, index=interactions.index)],
+        axis=1,
+    )
+
+
+# ============================================================================
+# ANALYTICS
+# ============================================================================
+
+def windowed_aggregates(interactions, feedback, window):
+    """Latency percentiles, retrieval distances and feedback ratio per time window"""
+    frames = []
+
+    if not interactions.empty:
+        grouped = interactions.set_index("timestamp").resample(window)
+        frames.append(pd.DataFrame({
+            "interactions": grouped["interaction_id"].count(),
+            "latency_p50_ms": grouped["latency_ms"].quantile(0.50),
+            "latency_p95_ms": grouped["latency_ms"].quantile(0.95),
+            "latency_p99_ms": grouped["latency_ms"].quantile(0.99),
+            "retrieval_top_distance_mean": grouped["retrieval_top_distance"].mean(),
+            "retrieval_mean_distance_mean": grouped["retrieval_mean_distance"].mean(),
+        }))
+
+    if not feedback.empty:
+        votes = (
+            feedback.set_index("timestamp")
+            .groupby([pd.Grouper(freq=window), "feedback"])
+            .size()
+            .unstack(fill_value=0)
+            .reindex(columns=["like", "dislike"], fill_value=0)
+        )
+        votes.columns = ["likes", "dislikes"]
+        frames.append(votes)
+
+    if not frames:
+        return pd.DataFrame(columns=AGGREGATE_COLUMNS)
+
+    aggregates = pd.concat(frames, axis=1)
+    aggregates.index.name = "window_start"
+    aggregates = aggregates.reset_index().reindex(columns=AGGREGATE_COLUMNS)
+    counts = ["interactions", "likes", "dislikes"]
+    aggregates[counts] = aggregates[counts].fillna(0).astype(int)
+    votes_total = aggregates["likes"] + aggregates["dislikes"]
+    aggregates["feedback_ratio"] = aggregates["likes"] / votes_total.where(votes_total > 0)
+    return aggregates
+
+
+def aggregates_size():
+    """Current size of the aggregates CSV in bytes"""
+    return os.path.getsize(AGGREGATES_FILE) if os.path.exists(AGGREGATES_FILE) else 0
+
+
+def truncate_aggregates(size):
+    """Drop rows a crashed run appended after the CSV had `size` bytes"""
+    if aggregates_size() > size:
+        with open(AGGREGATES_FILE, "r+b") as f:
+            f.truncate(size)
+
+
+def append_aggregates(aggregates):
+    """Append this run's window aggregates to the aggregates CSV.
+
+    Runs only read up to the start of the current window and drop late events,
+    so every window is complete and written exactly once.
+    """
+    if aggregates.empty:
+        return
+    write_header = aggregates_size() == 0
+    aggregates.reindex(columns=AGGREGATE_COLUMNS).to_csv(
+        AGGREGATES_FILE, mode="a", header=write_header, index=False
+    )
+
+
+def usable_columns(columns, *frames):
+    """Columns that hold at least one value in every non-empty frame"""
+    return [
+        c for c in columns
+        if all(c in f.columns and f[c].notna().any() for f in frames if not f.empty)
+    ]
+
+
+def embeddings_usable(reference, embedding_columns):
+    """Embedding drift needs every reference row to carry a full embedding"""
+    if reference.empty or not embedding_columns:
+        return False
+    if not set(embedding_columns).issubset(reference.columns):
+        return False
+    return bool(reference[embedding_columns].notna().all().all())
+
+
+def roll_reference(reference, batch, reference_size):
+    """Append the batch to the reference window and keep the newest rows.
+
+    Embedding columns the batch does not carry are dropped from the reference,
+    so a run with --no-embeddings does not leave stale vectors behind. Rows of
+    the batch already in the reference are replaced, so a replay adds nothing.
+    """
+    batch_embeddings = {c for c in batch.columns if c.startswith(EMBEDDING_PREFIX)}
+    stale = [c for c in reference.columns if c.startswith(EMBEDDING_PREFIX) and c not in batch_embeddings]
+    reference = reference.drop(columns=stale)
+    if "interaction_id" in reference.columns and "interaction_id" in batch.columns:
+        reference = reference[~reference["interaction_id"].isin(batch["interaction_id"])]
+    return pd.concat([reference, batch], ignore_index=True).tail(reference_size)
+
+
+def build_report(reference, current, embedding_columns):
+    """Summary metrics for the batch, plus drift metrics when a reference exists"""
+    from evidently import ColumnMapping
+    from evidently.metric_preset import DataDriftPreset
+    from evidently.metrics import (
+        ColumnQuantileMetric,
+        ColumnSummaryMetric,
+        DatasetSummaryMetric,
+        EmbeddingsDriftMetric,
+    )
+    from evidently.report import Report
+
+    # All-NaN columns (e.g. no retrieval distances logged) break Evidently metrics
+    numerical = usable_columns(NUMERICAL_FEATURES, current, reference)
+    categorical = usable_columns(CATEGORICAL_FEATURES, current, reference)
+
+    metrics = [DatasetSummaryMetric()]
+    if "latency_ms" in numerical:
+        metrics.append(ColumnQuantileMetric(column_name="latency_ms", quantile=0.95))
+    metrics += [ColumnSummaryMetric(column_name=c) for c in numerical + categorical]
+
+    column_mapping = ColumnMapping(
+        datetime="timestamp",
+        numerical_features=numerical,
+        categorical_features=categorical,
+        text_features=["user_input", "response"],
+    )
+
+    if not reference.empty:
+        if numerical + categorical:
+            metrics.append(DataDriftPreset(columns=numerical + categorical))
+        if embeddings_usable(reference, embedding_columns):
+            column_mapping.embeddings = {"query": embedding_columns}
+            metrics.append(EmbeddingsDriftMetric("query"))
+
+    report = Report(metrics=metrics)
+    report.run(
+        reference_data=reference if not reference.empty else None,
+        current_data=current,
+        column_mapping=column_mapping,
+    )
+    return report
+
+
+def get_project(ws):
+    """Get or create the Evidently monitoring project"""
+    search_result = ws.search_project(PROJECT_NAME)
+    if search_result:
+        return search_result[0]
+    project = ws.create_project(PROJECT_NAME)
+    project.description = "Monitoring chatbot interactions"
+    project.save()
+    return project
+
+
+# ============================================================================
+# JOB
+# ============================================================================
+
+def quarantine_batch(events, batch_id):
+    """Keep the raw events of a batch that could not be analysed"""
+    os.makedirs(QUARANTINE_DIR, exist_ok=True)
+    path = os.path.join(QUARANTINE_DIR, f"batch-{batch_id}.jsonl")
+    with open(path, "w", encoding="utf-8") as f:
+        for event in events:
+            f.write(json.dumps(event, ensure_ascii=False) + "\n")
+    return path
+
+
+def analyse_batch(interactions, reference_size, embeddings, done, mark):
+    """Embed the batch, add its drift report and roll the reference window.
+
+    Steps listed in `done` are skipped; `mark` records a finished step.
+    """
+    from evidently.ui.workspace import Workspace
+
+    embedding_columns = []
+    if embeddings is not None:
+        interactions = add_query_embeddings(interactions, embeddings)
+        embedding_columns = [c for c in interactions.columns if c.startswith(EMBEDDING_PREFIX)]
+
+    reference = load_reference()
+
+    if "report" not in done:
+        report = build_report(reference, interactions, embedding_columns)
+        ws = Workspace.create(WORKSPACE_PATH)
+        project = get_project(ws)
+        ws.add_report(project.id, report)
+        mark("report")
+        print(f"✓ Report added to Evidently project '{PROJECT_NAME}'")
+
+    if "reference" not in done:
+        save_reference(roll_reference(reference, interactions, reference_size))
+        mark("reference")
+
+
+def next_batch(state, window):
+    """Return the batch to process and its events.
+
+    A pending batch left by an interrupted run is re-read exactly; otherwise a
+    new batch is read up to the start of the current window.
+    """
+    log_size = os.path.getsize(INTERACTIONS_LOG) if os.path.exists(INTERACTIONS_LOG) else 0
+    if log_size < state["offset"]:
+        # The log was rotated or truncated: start over from its beginning
+        state.update(offset=0, pending=None)
+
+    since = pd.Timestamp(state["last_window"]) if state["last_window"] else None
+    pending = state["pending"]
+    if pending is not None and log_size >= pending["end"]:
+        events, _ = read_new_events(INTERACTIONS_LOG, state["offset"], since=since, end=pending["end"])
+        return pending, events
+
+    until = pd.Timestamp.now().floor(window)
+    events, end = read_new_events(INTERACTIONS_LOG, state["offset"], until=until, since=since)
+    pending = {
+        "end": end,
+        "until": until.isoformat(),
+        "aggregates_size": aggregates_size(),
+        "done": [],
+    }
+    return pending, events
+
+
+def run_once(window="1h", reference_size=1000, with_embeddings=True, max_attempts=3):
+    """Process every closed window appended to the log since the last watermark.
+
+    Setup and I/O errors fail the run and leave the watermark where it was.
+    Analysis errors are retried on the next runs; after `max_attempts` the
+    batch is quarantined and the watermark moves past it.
+    """
+    os.makedirs(STATE_DIR, exist_ok=True)
+
+    # Fail before touching any state if the model cannot be loaded
+    embeddings = load_embeddings() if with_embeddings else None
+
+    state = load_state()
+    pending, events = next_batch(state, window)
+
+    if not events:
+        state.update(offset=pending["end"], last_window=pending["until"], failures=0, pending=None)
+        save_state(state)
+        print("No closed windows with new interactions since last run")
+        return
+
+    state["pending"] = pending
+    save_state(state)
+
+    done = pending["done"]
+
+    def mark(step):
+        done.append(step)
+        save_state(state)
+
+    batch_id = f"{state['offset']}-{pending['end']}"
+    interactions, feedback = build_frames(events)
+    print(f"📥 Read {len(interactions)} interaction(s) and {len(feedback)} feedback event(s)")
+
+    if not interactions.empty and not {"report", "reference"} <= set(done):
+        try:
+            analyse_batch(interactions, reference_size, embeddings, done, mark)
+        except OSError:
+            raise
+        except Exception as e:
+            state["failures"] += 1
+            if state["failures"] < max_attempts:
+                save_state(state)
+                print(f"⚠ Drift analysis failed (attempt {state['failures']}/{max_attempts}): {e}")
+                raise
+            path = quarantine_batch(events, batch_id)
+            print(f"⚠ Drift analysis failed {state['failures']} times ({e}); batch quarantined to {path}")
+            done.extend(step for step in ("report", "reference") if step not in done)
+            save_state(state)
+
+    if "aggregates" not in done:
+        truncate_aggregates(pending["aggregates_size"])
+        append_aggregates(windowed_aggregates(interactions, feedback, window))
+        mark("aggregates")
+
+    state.update(offset=pending["end"], last_window=pending["until"], failures=0, pending=None)
+    save_state(state)
+    print(f"✓ Watermark advanced to byte {state['offset']}")
+
+
+def replay_quarantine(reference_size=1000, with_embeddings=True):
+    """Re-run drift analysis for quarantined batches, removing each on success.
+
+    Aggregates of quarantined batches were already written, so only the report
+    and the reference window are produced.
+    """
+    embeddings = load_embeddings() if with_embeddings else None
+
+    for path in sorted(glob.glob(os.path.join(QUARANTINE_DIR, "batch-*.jsonl"))):
+        with open(path, encoding="utf-8") as f:
+            events = [json.loads(line) for line in f if line.strip()]
+        interactions, _ = build_frames(events)
+        if not interactions.empty:
+            analyse_batch(interactions, reference_size, embeddings, [], lambda step: None)
+        os.remove(path)
+        print(f"✓ Replayed {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental chatbot monitoring job")
+    parser.add_argument("--interval", type=int, default=0,
+                        help="Seconds between runs (0 = run once and exit)")
+    parser.add_argument("--window", default="1h",
+                        help="Aggregation window as a pandas frequency, e.g. 15min, 1h, 1D")
+    parser.add_argument("--reference-size", type=int, default=1000,
+                        help="Number of most recent interactions kept as drift reference")
+    parser.add_argument("--no-embeddings", action="store_true",
+                        help="Skip query embeddings and topic drift")
+    parser.add_argument("--max-attempts", type=int, default=3,
+                        help="Failed analysis attempts before a batch is quarantined")
+    parser.add_argument("--replay-quarantine", action="store_true",
+                        help="Re-analyse quarantined batches and exit")
+    args = parser.parse_args()
+
+    if args.replay_quarantine:
+        replay_quarantine(args.reference_size, not args.no_embeddings)
+        return
+
+    while True:
+        try:
+            run_once(args.window, args.reference_size, not args.no_embeddings, args.max_attempts)
+        except Exception as e:
+            if not args.interval:
+                raise
+            print(f"Monitoring run failed: {e}")
+
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+import json
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+import monitoring_job  # noqa: E402
+
+
+def write_events(path, events, trailing=b""):
+    with open(path, "wb") as f:
+        for event in events:
+            f.write((json.dumps(event) + "\n").encode("utf-8"))
+        f.write(trailing)
+
+
+def interaction(timestamp, latency_ms=100.0, distances=(0.4, 0.6)):
+    return {
+        "timestamp": timestamp,
+        "event": "interaction",
+        "interaction_id": f"id-{timestamp}",
+        "language": "en",
+        "user_input": "reset my password",
+        "response": "Use the self-service portal.",
+        "latency_ms": latency_ms,
+        "retrieval_distances": list(distances),
+    }
+
+
+def vote(timestamp, feedback="like"):
+    return {
+        "timestamp": timestamp,
+        "event": "feedback",
+        "interaction_id": "id-x",
+        "feedback": feedback,
+    }
+
+
+# ============================================================================
+# INCREMENTAL READ
+# ============================================================================
+
+def test_read_new_events_leaves_partial_trailing_line(tmp_path):
+    log = tmp_path / "interactions.jsonl"
+    write_events(log, [interaction("2026-01-01T10:00:00")], trailing=b'{"timestamp": "2026-')
+
+    events, offset = monitoring_job.read_new_events(str(log), 0)
+
+    assert len(events) == 1
+    assert offset == log.stat().st_size - len(b'{"timestamp": "2026-')
+
+
+def test_read_new_events_resumes_from_offset(tmp_path):
+    log = tmp_path / "interactions.jsonl"
+    write_events(log, [interaction("2026-01-01T10:00:00")])
+    _, offset = monitoring_job.read_new_events(str(log), 0)
+
+    write_events(log, [interaction("2026-01-01T10:00:00"), interaction("2026-01-01T10:05:00")])
+    events, new_offset = monitoring_job.read_new_events(str(log), offset)
+
+    assert [e["timestamp"] for e in events] == ["2026-01-01T10:05:00"]
+    assert new_offset == log.stat().st_size
+
+
+def test_read_new_events_restarts_after_truncation(tmp_path):
+    log = tmp_path / "interactions.jsonl"
+    write_events(log, [interaction("2026-01-01T10:00:00")])
+
+    events, offset = monitoring_job.read_new_events(str(log), 10_000)
+
+    assert len(events) == 1
+    assert offset == log.stat().st_size
+
+
+def test_read_new_events_stops_at_open_window(tmp_path):
+    log = tmp_path / "interactions.jsonl"
+    write_events(log, [interaction("2026-01-01T10:59:00"), interaction("2026-01-01T11:01:00")])
+
+    events, offset = monitoring_job.read_new_events(
+        str(log), 0, until=pd.Timestamp("2026-01-01T11:00:00")
+    )
+
+    assert [e["timestamp"] for e in events] == ["2026-01-01T10:59:00"]
+    events, _ = monitoring_job.read_new_events(str(log), offset)
+    assert [e["timestamp"] for e in events] == ["2026-01-01T11:01:00"]
+
+
+def test_read_new_events_missing_log(tmp_path):
+    assert monitoring_job.read_new_events(str(tmp_path / "missing.jsonl"), 42) == ([], 0)
+
+
+def test_read_new_events_skips_bad_timestamps(tmp_path):
+    log = tmp_path / "interactions.jsonl"
+    bad = dict(interaction("2026-01-01T10:00:00"), timestamp="not a time")
+    missing = {k: v for k, v in interaction("2026-01-01T10:00:00").items() if k != "timestamp"}
+    write_events(log, [bad, missing, interaction("2026-01-01T10:05:00")])
+
+    events, offset = monitoring_job.read_new_events(str(log), 0, until=pd.Timestamp("2026-01-02"))
+
+    assert [e["timestamp"] for e in events] == ["2026-01-01T10:05:00"]
+    assert offset == log.stat().st_size
+
+
+def test_read_new_events_drops_late_events(tmp_path):
+    log = tmp_path / "interactions.jsonl"
+    write_events(log, [interaction("2026-01-01T10:59:59"), interaction("2026-01-01T11:00:01")])
+
+    events, offset = monitoring_job.read_new_events(str(log), 0, since=pd.Timestamp("2026-01-01T11:00:00"))
+
+    assert [e["timestamp"] for e in events] == ["2026-01-01T11:00:01"]
+    assert offset == log.stat().st_size
+
+
+# ============================================================================
+# FRAMES AND AGGREGATES
+# ============================================================================
+
+def test_build_frames_splits_events():
+    interactions, feedback = monitoring_job.build_frames([
+        interaction("2026-01-01T10:00:00", distances=(0.2, 0.6)),
+        interaction("2026-01-01T10:01:00", distances=()),
+        vote("2026-01-01T10:02:00"),
+    ])
+
+    assert len(interactions) == 2
+    assert len(feedback) == 1
+    assert interactions.loc[0, "retrieval_top_distance"] == pytest.approx(0.2)
+    assert interactions.loc[0, "retrieval_mean_distance"] == pytest.approx(0.4)
+    assert pd.isna(interactions.loc[1, "retrieval_top_distance"])
+
+
+def test_windowed_aggregates_columns_are_fixed():
+    interactions, feedback = monitoring_job.build_frames([
+        interaction("2026-01-01T10:00:00", latency_ms=100.0),
+        interaction("2026-01-01T10:30:00", latency_ms=300.0),
+        vote("2026-01-01T10:40:00", "like"),
+        vote("2026-01-01T10:50:00", "dislike"),
+    ])
+    votes_only = monitoring_job.build_frames([vote("2026-01-01T11:10:00")])
+    interactions_only = monitoring_job.build_frames([interaction("2026-01-01T12:00:00")])
+
+    mixed = monitoring_job.windowed_aggregates(interactions, feedback, "1h")
+    only_votes = monitoring_job.windowed_aggregates(*votes_only, "1h")
+    only_interactions = monitoring_job.windowed_aggregates(*interactions_only, "1h")
+
+    for aggregates in (mixed, only_votes, only_interactions):
+        assert list(aggregates.columns) == monitoring_job.AGGREGATE_COLUMNS
+
+    row = mixed.iloc[0]
+    assert row["interactions"] == 2
+    assert row["latency_p50_ms"] == pytest.approx(200.0)
+    assert row["feedback_ratio"] == pytest.approx(0.5)
+
+    assert only_votes.iloc[0]["interactions"] == 0
+    assert only_votes.iloc[0]["feedback_ratio"] == pytest.approx(1.0)
+    assert pd.isna(only_interactions.iloc[0]["feedback_ratio"])
+
+
+def test_append_aggregates_keeps_header_alignment(tmp_path, monkeypatch):
+    monkeypatch.setattr(monitoring_job, "AGGREGATES_FILE", str(tmp_path / "aggregates.csv"))
+
+    monitoring_job.append_aggregates(
+        monitoring_job.windowed_aggregates(*monitoring_job.build_frames([vote("2026-01-01T10:10:00")]), "1h")
+    )
+    monitoring_job.append_aggregates(
+        monitoring_job.windowed_aggregates(*monitoring_job.build_frames([interaction("2026-01-01T11:00:00")]), "1h")
+    )
+
+    written = pd.read_csv(tmp_path / "aggregates.csv")
+    assert list(written.columns) == monitoring_job.AGGREGATE_COLUMNS
+    assert list(written["likes"]) == [1, 0]
+    assert list(written["interactions"]) == [0, 1]
+
+
+# ============================================================================
+# REFERENCE WINDOW
+# ============================================================================
+
+def test_usable_columns_drops_all_nan():
+    current = pd.DataFrame({"latency_ms": [1.0], "retrieval_top_distance": [float("nan")]})
+
+    assert monitoring_job.usable_columns(
+        ["latency_ms", "retrieval_top_distance"], current, pd.DataFrame()
+    ) == ["latency_ms"]
+
+
+def test_embeddings_need_complete_reference():
+    columns = ["query_emb_0", "query_emb_1"]
+    without = pd.DataFrame({"latency_ms": [1.0, 2.0]})
+    with_embeddings = pd.DataFrame({"latency_ms": [3.0], "query_emb_0": [0.1], "query_emb_1": [0.2]})
+
+    mixed = monitoring_job.roll_reference(without, with_embeddings, 10)
+
+    assert not monitoring_job.embeddings_usable(mixed, columns)
+    assert monitoring_job.embeddings_usable(mixed.tail(1), columns)
+
+
+def test_roll_reference_drops_stale_embeddings_and_trims():
+    reference = pd.DataFrame({"latency_ms": [1.0, 2.0], "query_emb_0": [0.1, 0.2]})
+    batch = pd.DataFrame({"latency_ms": [3.0, 4.0]})
+
+    rolled = monitoring_job.roll_reference(reference, batch, 3)
+
+    assert list(rolled.columns) == ["latency_ms"]
+    assert list(rolled["latency_ms"]) == [2.0, 3.0, 4.0]
+
+
+# ============================================================================
+# JOB
+# ============================================================================
+
+@pytest.fixture
+def job(tmp_path, monkeypatch):
+    """Point the job at tmp_path and record analyse_batch calls"""
+    state_dir = tmp_path / "monitoring"
+    monkeypatch.setattr(monitoring_job, "STATE_DIR", str(state_dir))
+    monkeypatch.setattr(monitoring_job, "WATERMARK_FILE", str(state_dir / "watermark.json"))
+    monkeypatch.setattr(monitoring_job, "AGGREGATES_FILE", str(state_dir / "aggregates.csv"))
+    monkeypatch.setattr(monitoring_job, "QUARANTINE_DIR", str(state_dir / "quarantine"))
+    monkeypatch.setattr(monitoring_job, "INTERACTIONS_LOG", str(tmp_path / "interactions.jsonl"))
+
+    calls = []
+
+    def analyse_batch(interactions, reference_size, embeddings, done, mark):
+        calls.append(len(interactions))
+        for step in ("report", "reference"):
+            if step not in done:
+                mark(step)
+
+    monkeypatch.setattr(monitoring_job, "analyse_batch", analyse_batch)
+    return calls
+
+
+def run(**kwargs):
+    monitoring_job.run_once(with_embeddings=False, **kwargs)
+
+
+def aggregate_rows():
+    if not Path(monitoring_job.AGGREGATES_FILE).exists():
+        return []
+    return list(pd.read_csv(monitoring_job.AGGREGATES_FILE)["window_start"])
+
+
+def test_run_once_without_log(job):
+    run()
+
+    state = monitoring_job.load_state()
+    assert state["offset"] == 0
+    assert state["pending"] is None
+    assert job == []
+
+
+def test_run_once_processes_closed_windows_and_holds_open_one(job):
+    log = Path(monitoring_job.INTERACTIONS_LOG)
+    now = pd.Timestamp.now().isoformat()
+    write_events(log, [interaction("2026-01-01T10:00:00"), interaction("2026-01-01T11:00:00"), interaction(now)])
+    closed_bytes = sum(len(line) for line in log.read_bytes().splitlines(keepends=True)[:2])
+
+    run()
+
+    state = monitoring_job.load_state()
+    assert state["offset"] == closed_bytes
+    assert state["pending"] is None
+    assert pd.Timestamp(state["last_window"]) <= pd.Timestamp(now)
+    assert job == [2]
+    assert aggregate_rows() == ["2026-01-01 10:00:00", "2026-01-01 11:00:00"]
+
+    run()
+    assert job == [2]
+    assert monitoring_job.load_state()["offset"] == closed_bytes
+
+
+def test_run_once_retries_then_quarantines(job, monkeypatch):
+    write_events(Path(monitoring_job.INTERACTIONS_LOG), [interaction("2026-01-01T10:00:00")])
+
+    def failing(*args):
+        raise ValueError("bad batch")
+
+    monkeypatch.setattr(monitoring_job, "analyse_batch", failing)
+
+    for attempt in (1, 2):
+        with pytest.raises(ValueError):
+            run(max_attempts=3)
+        state = monitoring_job.load_state()
+        assert state["offset"] == 0
+        assert state["failures"] == attempt
+        assert aggregate_rows() == []
+
+    run(max_attempts=3)
+
+    state = monitoring_job.load_state()
+    assert state["offset"] == Path(monitoring_job.INTERACTIONS_LOG).stat().st_size
+    assert state["failures"] == 0
+    assert aggregate_rows() == ["2026-01-01 10:00:00"]
+    assert len(list(Path(monitoring_job.QUARANTINE_DIR).glob("batch-*.jsonl"))) == 1
+
+
+def test_run_once_io_error_keeps_watermark(job, monkeypatch):
+    write_events(Path(monitoring_job.INTERACTIONS_LOG), [interaction("2026-01-01T10:00:00")])
+
+    def disk_full(*args):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(monitoring_job, "analyse_batch", disk_full)
+
+    for _ in range(5):
+        with pytest.raises(OSError):
+            run(max_attempts=3)
+
+    state = monitoring_job.load_state()
+    assert state["offset"] == 0
+    assert state["failures"] == 0
+    assert not Path(monitoring_job.QUARANTINE_DIR).exists()
+    assert aggregate_rows() == []
+
+
+def test_run_once_setup_error_keeps_state(job, monkeypatch):
+    write_events(Path(monitoring_job.INTERACTIONS_LOG), [interaction("2026-01-01T10:00:00")])
+
+    def offline():
+        raise OSError("model download failed")
+
+    monkeypatch.setattr(monitoring_job, "load_embeddings", offline)
+
+    with pytest.raises(OSError):
+        monitoring_job.run_once()
+
+    assert not Path(monitoring_job.WATERMARK_FILE).exists()
+
+
+def test_run_once_resumes_interrupted_batch(job, monkeypatch):
+    log = Path(monitoring_job.INTERACTIONS_LOG)
+    write_events(log, [interaction("2026-01-01T10:00:00"), vote("2026-01-01T10:10:00")])
+    append = monitoring_job.append_aggregates
+
+    def crash_after_write(aggregates):
+        append(aggregates)
+        raise RuntimeError("killed")
+
+    monkeypatch.setattr(monitoring_job, "append_aggregates", crash_after_write)
+    with pytest.raises(RuntimeError):
+        run()
+    assert monitoring_job.load_state()["pending"]["done"] == ["report", "reference"]
+
+    batch_end = log.stat().st_size
+
+    # An event arriving before the retry is not pulled into the pending batch
+    with open(log, "ab") as f:
+        f.write((json.dumps(interaction("2026-01-01T11:00:00")) + "\n").encode("utf-8"))
+
+    monkeypatch.setattr(monitoring_job, "append_aggregates", append)
+    run()
+
+    assert job == [1]
+    assert aggregate_rows() == ["2026-01-01 10:00:00"]
+    assert monitoring_job.load_state()["offset"] == batch_end
+
+
+def test_run_once_drops_events_of_reported_windows(job):
+    log = Path(monitoring_job.INTERACTIONS_LOG)
+    write_events(log, [interaction("2026-01-01T11:00:00")])
+    run()
+
+    with open(log, "ab") as f:
+        f.write((json.dumps(interaction("2026-01-01T10:59:59")) + "\n").encode("utf-8"))
+    run()
+
+    assert aggregate_rows() == ["2026-01-01 11:00:00"]
+    assert monitoring_job.load_state()["offset"] == log.stat().st_size
+
+
+def test_replay_quarantine_removes_replayed_batches(job):
+    quarantine = Path(monitoring_job.QUARANTINE_DIR)
+    quarantine.mkdir(parents=True)
+    write_events(quarantine / "batch-0-10.jsonl", [interaction("2026-01-01T10:00:00")])
+
+    monitoring_job.replay_quarantine(with_embeddings=False)
+
+    assert job == [1]
+    assert list(quarantine.iterdir()) == []
+
+
+# ============================================================================
+# REPORT
+# ============================================================================
+
+def test_build_report_without_reference():
+    pytest.importorskip("evidently")
+    current, _ = monitoring_job.build_frames([
+        interaction("2026-01-01T10:00:00", distances=()),
+        interaction("2026-01-01T10:05:00", distances=()),
+    ])
+
+    report = monitoring_job.build_report(pd.DataFrame(), current, [])
+    metrics = report.as_dict()["metrics"]
+    names = [m["metric"] for m in metrics]
+
+    assert "DataDriftTable" not in names
+    assert "EmbeddingsDriftMetric" not in names
+    summarised = {
+        m["result"]["column_name"] for m in metrics if m["metric"] == "ColumnSummaryMetric"
+    }
+    assert summarised == {"input_length", "response_length", "latency_ms", "language"}